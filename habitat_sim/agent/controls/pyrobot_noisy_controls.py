@@ -4,11 +4,13 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import functools
+import math
+from typing import Callable, Optional, Tuple
 
 import attr
-import magnum as mn
 import numpy as np
-import scipy.stats
+from scipy.special import ndtr, ndtri
 
 import habitat_sim.bindings as hsim
 from habitat_sim import utils
@@ -19,42 +21,82 @@ from habitat_sim.agent.controls.controls import (
 )
 
 
+# Number of uniform draws made at once by a noise model
+_UNIFORM_BATCH_SIZE = 1024
+
+
 @attr.s(auto_attribs=True)
 class _TruncatedMultivariateGaussian:
     mean: np.array
     cov: np.array
+    # If None, draws come from numpy's global random state so that np.random.seed
+    # controls the noise
+    rng: Optional[np.random.Generator] = None
 
     def __attrs_post_init__(self):
-        self.mean = np.array(self.mean)
-        self.cov = np.array(self.cov)
-        if len(self.cov.shape) == 1:
+        self.mean = np.array(self.mean, dtype=np.float64)
+        self.cov = np.array(self.cov, dtype=np.float64)
+        if self.cov.ndim == 1:
             self.cov = np.diag(self.cov)
-
-        assert (
-            np.count_nonzero(self.cov - np.diag(np.diagonal(self.cov))) == 0
-        ), "Only supports diagonal covariance"
+        else:
+            assert not np.any(
+                self.cov[~np.eye(len(self.cov), dtype=bool)]
+            ), "Only supports diagonal covariance"
+
+        self._stdev = np.sqrt(np.diagonal(self.cov))
+        # Always truncate to 3 standard deviations
+        self._default_pa = np.full_like(self.mean, ndtr(-3.0))
+        self._default_pb = np.full_like(self.mean, ndtr(3.0))
+
+        # Pre-drawn uniforms and the number of them left when drawing from a
+        # generator.  These do not depend on the truncation, so one batch serves
+        # every call
+        self._uniforms = None
+        self._num_uniforms_left = 0
+
+    def _next_uniforms(self):
+        if self.rng is None:
+            # Not batched, so that reseeding the global state takes effect on the
+            # very next draw
+            return np.random.random(len(self.mean))
+
+        if self._num_uniforms_left == 0:
+            self._uniforms = self.rng.random((_UNIFORM_BATCH_SIZE, len(self.mean)))
+            self._num_uniforms_left = _UNIFORM_BATCH_SIZE
+
+        self._num_uniforms_left -= 1
+        return self._uniforms[self._num_uniforms_left]
+
+    def _inverse_cdf(self, pa, pb):
+        # Inverse-CDF sampling of a truncated normal, for all dimensions at once
+        u = self._next_uniforms()
+        return ndtri(pa + u * (pb - pa)) * self._stdev + self.mean
 
     def sample(self, truncation=None):
+        pa, pb = self._default_pa, self._default_pb
+
         if truncation is not None:
             assert len(truncation) == len(self.mean)
 
-        sample = np.zeros_like(self.mean)
-        for i in range(len(self.mean)):
-            stdev = np.sqrt(self.cov[i, i])
-            mean = self.mean[i]
-            # Always truncate to 3 standard deviations
-            a, b = -3, 3
+            lower = np.array(
+                [-np.inf if t is None or t[0] is None else t[0] for t in truncation]
+            )
+            upper = np.array(
+                [np.inf if t is None or t[1] is None else t[1] for t in truncation]
+            )
+            pa = ndtr(np.maximum((lower - self.mean) / self._stdev, -3.0))
+            pb = ndtr(np.minimum((upper - self.mean) / self._stdev, 3.0))
 
-            if truncation is not None and truncation[i] is not None:
-                trunc = truncation[i]
-                if trunc[0] is not None:
-                    a = max((trunc[0] - mean) / stdev, a)
-                if trunc[1] is not None:
-                    b = min((trunc[1] - mean) / stdev, b)
+        return self._inverse_cdf(pa, pb)
 
-            sample[i] = scipy.stats.truncnorm.rvs(a, b, mean, stdev)
+    def sample_partial_lower(self, lower: float, lane: int = 0):
+        r"""Same as :py:`sample()` with only the :py:`lane` th component
+        truncated, from below at :py:`lower`
+        """
+        pa = self._default_pa.copy()
+        pa[lane] = ndtr(max((lower - self.mean[lane]) / self._stdev[lane], -3.0))
 
-        return sample
+        return self._inverse_cdf(pa, self._default_pb)
 
 
 @attr.s(auto_attribs=True)
@@ -154,6 +196,61 @@ pyrobot_noise_models = {
 }
 
 
+_CONTROLLERS = ("ILQR", "Proportional", "Movebase")
+
+
+def _get_model(robot: str, controller: str, motion_type: str) -> MotionNoiseModel:
+    return getattr(pyrobot_noise_models[robot][controller], motion_type)
+
+
+def _child_seed_seq(
+    seed_seq: np.random.SeedSequence, index: int
+) -> np.random.SeedSequence:
+    r"""Returns the :py:`index` th child of :py:`seed_seq`, as
+    :py:`seed_seq.spawn()` would, but without changing the state of
+    :py:`seed_seq` so the same children are derived every time
+    """
+    return np.random.SeedSequence(
+        seed_seq.entropy,
+        spawn_key=seed_seq.spawn_key + (index,),
+        pool_size=seed_seq.pool_size,
+    )
+
+
+def _sample_lower_truncated(
+    joint: _TruncatedMultivariateGaussian, split: int, lane: int, lower: float
+):
+    sample = joint.sample_partial_lower(lower, lane)
+
+    return sample[:split], sample[split:]
+
+
+def _make_sampler(
+    model: MotionNoiseModel, lane: int, rng: Optional[np.random.Generator]
+):
+    r"""Returns a function that takes a lower bound for the :py:`lane` th
+    component of :py:`model` and returns a (translation noise, rotation noise)
+    sample truncated to it
+
+    The linear and rotation components are independent, so both are drawn
+    from a single gaussian over their concatenated dimensions, built from
+    the components as they are now.  It draws from :py:`rng`, or from
+    :py:`model.linear.rng` if that is None; the rng of :py:`model.rotation`
+    is not used
+    """
+    joint = _TruncatedMultivariateGaussian(
+        np.concatenate([model.linear.mean, model.rotation.mean]),
+        np.concatenate(
+            [np.diagonal(model.linear.cov), np.diagonal(model.rotation.cov)]
+        ),
+        rng=model.linear.rng if rng is None else rng,
+    )
+
+    return functools.partial(
+        _sample_lower_truncated, joint, len(model.linear.mean), lane
+    )
+
+
 @attr.s(auto_attribs=True)
 class PyRobotNoisyActuationSpec(ActuationSpec):
     r"""Struct to hold parameters for pyrobot noise model
@@ -172,6 +269,13 @@ class PyRobotNoisyActuationSpec(ActuationSpec):
             ILQR is the default
         noise_multiplier (float): Multiplier on the noise amount,
             useful for ablating the effect of noise
+        seed_seq (Optional[np.random.SeedSequence]): If set, the noise for
+            this spec is drawn from generators spawned from this seed sequence
+            instead of numpy's global random state.  For reproducible
+            parallel rollouts, give each environment its own child of a root
+            sequence, i.e. :py:`np.random.SeedSequence(seed).spawn(num_envs)`.
+            The noise streams are derived from the seed sequence without
+            changing it, so a pickled or copied spec restarts the same streams
     """
     robot: str = attr.ib(default="LoCoBot")
 
@@ -183,18 +287,60 @@ class PyRobotNoisyActuationSpec(ActuationSpec):
 
     @controller.validator
     def check(self, attribute, value):
-        assert value in [
-            "ILQR",
-            "Proportional",
-            "Movebase",
-        ], f"{value} not a known controller"
+        assert value in _CONTROLLERS, f"{value} not a known controller"
 
     noise_multiplier: float = 1.0
+    seed_seq: Optional[np.random.SeedSequence] = None
 
+    def __attrs_post_init__(self):
+        self._build_samplers()
+
+    def _build_samplers(self):
+        linear_motion = _get_model(self.robot, self.controller, "linear_motion")
+        rotational_motion = _get_model(self.robot, self.controller, "rotational_motion")
+
+        linear_rng, rotational_rng = None, None
+        if self.seed_seq is not None:
+            linear_rng = np.random.default_rng(_child_seed_seq(self.seed_seq, 0))
+            rotational_rng = np.random.default_rng(_child_seed_seq(self.seed_seq, 1))
+
+        # The noise samplers are specialized to the robot and controller here,
+        # and rebuilt by __setattr__ if either changes.  Linear motions are
+        # truncated on the forward translation and rotational motions on the
+        # rotation, the first component after the translation
+        self._linear_sampler = _make_sampler(linear_motion, 0, linear_rng)
+        self._rotational_sampler = _make_sampler(
+            rotational_motion, len(rotational_motion.linear.mean), rotational_rng
+        )
 
-_X_AXIS = 0
-_Y_AXIS = 1
-_Z_AXIS = 2
+    def __setattr__(self, name, value):
+        if (
+            name not in ("robot", "controller", "seed_seq")
+            or "_linear_sampler" not in self.__dict__
+        ):
+            super().__setattr__(name, value)
+            return
+
+        # Validate before assigning so a rejected value leaves the spec and
+        # its samplers untouched
+        field = getattr(attr.fields(type(self)), name)
+        if field.validator is not None:
+            field.validator(self, field, value)
+
+        super().__setattr__(name, value)
+        self._build_samplers()
+
+    def __getstate__(self):
+        # The samplers reference the (possibly shared) noise models and their
+        # generators, so they are rebuilt on unpickling rather than copied
+        state = self.__dict__.copy()
+        del state["_linear_sampler"]
+        del state["_rotational_sampler"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_samplers()
 
 
 def _noisy_action_impl(
@@ -202,114 +348,90 @@ def _noisy_action_impl(
     translate_amount: float,
     rotate_amount: float,
     multiplier: float,
-    model: MotionNoiseModel,
+    sampler: Callable[[float], Tuple[np.ndarray, np.ndarray]],
     motion_type: str,
 ):
-    # Perform the action in the coordinate system of the node
-    transform = scene_node.transformation
-    move_ax = -transform[_Z_AXIS].xyz
-    perp_ax = transform[_X_AXIS].xyz
-
-    if motion_type == "rotational":
-        translation_noise = multiplier * model.linear.sample()
-    else:
+    if motion_type == "linear":
         # The robot will always move a little bit.  This has to be defined based on the intended actuation
         # as otherwise small rotation amounts would be invalid.  However, pretty quickly, we'll
         # get to the truncation of 3 sigma
-        trunc = [(-0.95 * np.abs(translate_amount), None), None]
+        lower = -0.95 * abs(translate_amount)
+    else:
+        # The robot will always turn a little bit.  Same deal as above
+        lower = -0.95 * abs(math.radians(rotate_amount))
 
-        translation_noise = multiplier * model.linear.sample(trunc)
+    translation_noise, rot_noise = sampler(lower)
+    translation_noise *= multiplier
+    rot_noise *= multiplier
 
     # + EPS to make sure 0 is positive.  We multiply by the sign of the translation
     # as otherwise forward would overshoot on average and backward would undershoot, while
     # both should overshoot
-    translation_noise *= np.sign(translate_amount + 1e-8)
+    translation_noise *= math.copysign(1.0, translate_amount + 1e-8)
 
-    scene_node.translate_local(
-        move_ax * (translate_amount + translation_noise[0])
-        + perp_ax * translation_noise[1]
+    # Same deal with rotation about + EPS and why we multiply by the sign
+    rot_noise *= math.copysign(1.0, rotate_amount + 1e-8)
+
+    # Perform the action in the coordinate system of the node.  The translation,
+    # the rotation and the renormalization of the rotation are all applied in one
+    # call into the bindings
+    scene_node.translate_rotate_y_local(
+        forward=translate_amount + float(translation_noise[0]),
+        perpendicular=float(translation_noise[1]),
+        angle_in_rad=math.radians(rotate_amount) + float(rot_noise[0]),
     )
 
-    if motion_type == "linear":
-        rot_noise = multiplier * model.rotation.sample()
-    else:
-        # The robot will always turn a little bit.  This has to be defined based on the intended actuation
-        # as otherwise small rotation amounts would be invalid.  However, pretty quickly, we'll
-        # get to the truncation of 3 sigma
-        trunc = [(-0.95 * np.abs(np.deg2rad(rotate_amount)), None)]
 
-        rot_noise = multiplier * model.rotation.sample(trunc)
+class _PyrobotNoisyControl(SceneNodeControl):
+    r"""Shared implementation of the pyrobot noisy controls
 
-    # Same deal with rotation about + EPS and why we multiply by the sign
-    rot_noise *= np.sign(rotate_amount + 1e-8)
-
-    scene_node.rotate_y_local(mn.Deg(rotate_amount) + mn.Rad(rot_noise))
-    scene_node.rotation = scene_node.rotation.normalized()
+    Subclasses set how the actuation amount is split between translation and
+    rotation (:py:`_translate_sign`, :py:`_rotate_sign`), which of the spec's
+    samplers to draw noise from (:py:`_sampler`) and the kind of motion
+    (:py:`_motion_type`, either linear or rotational)
+    """
 
+    _translate_sign: float
+    _rotate_sign: float
+    _sampler: str
+    _motion_type: str
 
-@register_move_fn(body_action=True)
-class PyrobotNoisyMoveBackward(SceneNodeControl):
     def __call__(
         self, scene_node: hsim.SceneNode, actuation_spec: PyRobotNoisyActuationSpec
     ):
         _noisy_action_impl(
             scene_node,
-            -actuation_spec.amount,
-            0.0,
+            self._translate_sign * actuation_spec.amount,
+            self._rotate_sign * actuation_spec.amount,
             actuation_spec.noise_multiplier,
-            pyrobot_noise_models[actuation_spec.robot][
-                actuation_spec.controller
-            ].linear_motion,
-            "linear",
+            getattr(actuation_spec, self._sampler),
+            self._motion_type,
         )
 
 
 @register_move_fn(body_action=True)
-class PyrobotNoisyMoveForward(SceneNodeControl):
-    def __call__(
-        self, scene_node: hsim.SceneNode, actuation_spec: PyRobotNoisyActuationSpec
-    ):
-        _noisy_action_impl(
-            scene_node,
-            actuation_spec.amount,
-            0.0,
-            actuation_spec.noise_multiplier,
-            pyrobot_noise_models[actuation_spec.robot][
-                actuation_spec.controller
-            ].linear_motion,
-            "linear",
-        )
+class PyrobotNoisyMoveBackward(_PyrobotNoisyControl):
+    _translate_sign, _rotate_sign = -1.0, 0.0
+    _sampler = "_linear_sampler"
+    _motion_type = "linear"
 
 
 @register_move_fn(body_action=True)
-class PyrobotNoisyTurnLeft(SceneNodeControl):
-    def __call__(
-        self, scene_node: hsim.SceneNode, actuation_spec: PyRobotNoisyActuationSpec
-    ):
-        _noisy_action_impl(
-            scene_node,
-            0.0,
-            actuation_spec.amount,
-            actuation_spec.noise_multiplier,
-            pyrobot_noise_models[actuation_spec.robot][
-                actuation_spec.controller
-            ].rotational_motion,
-            "rotational",
-        )
+class PyrobotNoisyMoveForward(_PyrobotNoisyControl):
+    _translate_sign, _rotate_sign = 1.0, 0.0
+    _sampler = "_linear_sampler"
+    _motion_type = "linear"
 
 
 @register_move_fn(body_action=True)
-class PyrobotNoisyTurnRight(SceneNodeControl):
-    def __call__(
-        self, scene_node: hsim.SceneNode, actuation_spec: PyRobotNoisyActuationSpec
-    ):
-        _noisy_action_impl(
-            scene_node,
-            0.0,
-            -actuation_spec.amount,
-            actuation_spec.noise_multiplier,
-            pyrobot_noise_models[actuation_spec.robot][
-                actuation_spec.controller
-            ].rotational_motion,
-            "rotational",
-        )
+class PyrobotNoisyTurnLeft(_PyrobotNoisyControl):
+    _translate_sign, _rotate_sign = 0.0, 1.0
+    _sampler = "_rotational_sampler"
+    _motion_type = "rotational"
+
+
+@register_move_fn(body_action=True)
+class PyrobotNoisyTurnRight(_PyrobotNoisyControl):
+    _translate_sign, _rotate_sign = 0.0, -1.0
+    _sampler = "_rotational_sampler"
+    _motion_type = "rotational"
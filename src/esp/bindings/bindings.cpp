@@ -95,6 +95,20 @@ PYBIND11_MODULE(habitat_sim_bindings, m) {
       .def(
           "create_child", [](SceneNode& self) { return &self.createChild(); },
           R"(Creates a child node, and sets its parent to the current node.)")
+      .def(
+          "translate_rotate_y_local",
+          [](SceneNode& self, float forward, float perpendicular,
+             float angleInRad) {
+            self.translateLocal(self.transformation().transformVector(
+                Magnum::Vector3{perpendicular, 0.0f, -forward}));
+            self.rotateYLocal(Magnum::Rad{angleInRad});
+            self.setRotation(self.rotation().normalized());
+          },
+          R"(Moves the node forward (along -Z) and perpendicular (along X)
+          using the axes of its transformation, then rotates it about its local
+          Y axis and renormalizes its rotation.  Same as calling translate_local
+          and rotate_y_local, but in a single call.)",
+          "forward"_a, "perpendicular"_a, "angle_in_rad"_a)
       .def_property_readonly("absolute_translation",
                              &SceneNode::absoluteTranslation);
 
@@ -5,6 +5,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import attr
+import magnum as mn
 import numpy as np
 import pytest
 import quaternion
@@ -196,3 +197,31 @@ def test_default_sensor_contorls(action, expected):
     for k, v in state.sensor_states.items():
         assert k in new_state.sensor_states
         _check_state_expected(v, new_state.sensor_states[k], expected)
+
+
+@pytest.mark.parametrize(
+    "forward,perpendicular,angle",
+    [(0.25, 0.0, 0.0), (-0.25, 0.03, 0.1), (0.0, -0.02, -1.5), (1.0, 0.5, 3.0)],
+)
+def test_translate_rotate_y_local(forward, perpendicular, angle):
+    scene_graph = hsim.SceneGraph()
+    nodes = [scene_graph.get_root_node().create_child() for _ in range(2)]
+    for node in nodes:
+        node.translation = mn.Vector3(1.0, 2.0, 3.0)
+        node.rotation = mn.Quaternion.rotation(
+            mn.Deg(30.0), mn.Vector3(1.0, 2.0, 0.5).normalized()
+        )
+
+    fused, reference = nodes
+    fused.translate_rotate_y_local(forward, perpendicular, angle)
+
+    transform = reference.transformation
+    reference.translate_local(
+        -transform[2].xyz * forward + transform[0].xyz * perpendicular
+    )
+    reference.rotate_y_local(mn.Rad(angle))
+    reference.rotation = reference.rotation.normalized()
+
+    assert np.allclose(
+        np.array(fused.transformation), np.array(reference.transformation), atol=1e-6
+    )
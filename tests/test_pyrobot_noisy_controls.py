@@ -6,17 +6,24 @@
 
 import contextlib
 import itertools
+import pickle
 
 import attr
 import numpy as np
 import pytest
 import quaternion
+import scipy.stats
 
 import habitat_sim
 import habitat_sim.bindings as hsim
 import habitat_sim.errors
 import habitat_sim.utils
-from habitat_sim.agent.controls.pyrobot_noisy_controls import pyrobot_noise_models
+from habitat_sim.agent.controls.pyrobot_noisy_controls import (
+    _UNIFORM_BATCH_SIZE,
+    MotionNoiseModel,
+    _TruncatedMultivariateGaussian,
+    pyrobot_noise_models,
+)
 
 
 def _delta_translation(a, b):
@@ -150,3 +157,159 @@ def test_pyrobot_noisy_actions(noise_multiplier, robot, controller):
             )
             < EPS
         )
+
+
+def _noisy_rollout(move_spec, turn_spec):
+    scene_graph = hsim.SceneGraph()
+    agent_config = habitat_sim.AgentConfiguration()
+    agent_config.action_space = dict(
+        noisy_move_forward=habitat_sim.ActionSpec(
+            "pyrobot_noisy_move_forward", move_spec
+        ),
+        noisy_turn_left=habitat_sim.ActionSpec("pyrobot_noisy_turn_left", turn_spec),
+    )
+    agent = habitat_sim.Agent(scene_graph.get_root_node().create_child(), agent_config)
+
+    positions = []
+    for _ in range(10):
+        agent.act("noisy_move_forward")
+        agent.act("noisy_turn_left")
+        positions.append(agent.state.position)
+
+    return np.stack(positions)
+
+
+def _seeded_specs(seed, **kwargs):
+    return (
+        habitat_sim.PyRobotNoisyActuationSpec(
+            amount=0.25, seed_seq=np.random.SeedSequence(seed), **kwargs
+        ),
+        habitat_sim.PyRobotNoisyActuationSpec(
+            amount=10.0, seed_seq=np.random.SeedSequence(seed), **kwargs
+        ),
+    )
+
+
+def test_pyrobot_noisy_actions_seeded():
+    assert np.allclose(
+        _noisy_rollout(*_seeded_specs(0)), _noisy_rollout(*_seeded_specs(0))
+    )
+    assert not np.allclose(
+        _noisy_rollout(*_seeded_specs(0)), _noisy_rollout(*_seeded_specs(1))
+    )
+
+    # A spec sent to a worker process gives the same noise as the original
+    specs = _seeded_specs(0)
+    unpickled = [pickle.loads(pickle.dumps(spec)) for spec in specs]
+    assert np.allclose(_noisy_rollout(*specs), _noisy_rollout(*unpickled))
+
+
+def test_pyrobot_noisy_spec_mutation():
+    specs = _seeded_specs(0)
+    for spec in specs:
+        spec.controller = "Movebase"
+        spec.robot = "LoCoBot-Lite"
+
+    # The mutated specs draw the same noise as freshly constructed ones
+    assert np.allclose(
+        _noisy_rollout(*specs),
+        _noisy_rollout(*_seeded_specs(0, robot="LoCoBot-Lite", controller="Movebase")),
+    )
+
+    # A rejected assignment leaves the spec as it was
+    specs = _seeded_specs(0)
+    for spec in specs:
+        with pytest.raises(AssertionError):
+            spec.controller = "Bogus"
+        assert spec.controller == "ILQR"
+
+    assert np.allclose(_noisy_rollout(*specs), _noisy_rollout(*_seeded_specs(0)))
+
+    for spec in specs:
+        spec.robot = "LoCoBot-Lite"
+    assert np.allclose(
+        _noisy_rollout(*specs), _noisy_rollout(*_seeded_specs(0, robot="LoCoBot-Lite"))
+    )
+
+
+def test_pyrobot_noisy_spec_uses_current_noise_model(monkeypatch):
+    # Components with their own generators are fine, only the linear one's is used
+    model = MotionNoiseModel(
+        _TruncatedMultivariateGaussian(
+            [0.5, 0.25], [1e-12, 1e-12], rng=np.random.default_rng(0)
+        ),
+        _TruncatedMultivariateGaussian([0.125], [1e-12], rng=np.random.default_rng(1)),
+    )
+    monkeypatch.setattr(pyrobot_noise_models["LoCoBot"].ILQR, "linear_motion", model)
+
+    spec = habitat_sim.PyRobotNoisyActuationSpec(amount=0.25)
+    translation_noise, rotation_noise = spec._linear_sampler(-np.inf)
+    assert np.allclose(translation_noise, [0.5, 0.25])
+    assert np.allclose(rotation_noise, [0.125])
+
+
+@pytest.mark.parametrize(
+    "truncation",
+    [
+        None,
+        [(0.05, None), None],
+        [None, (None, 0.3)],
+        [(0.0, 0.15), (-1.0, 0.25)],
+    ],
+)
+def test_truncated_gaussian_sample(truncation):
+    mean, stdev = np.array([0.1, 0.2]), np.array([0.1, 0.2])
+    gaussian = _TruncatedMultivariateGaussian(
+        mean, stdev ** 2, rng=np.random.default_rng(0)
+    )
+
+    num_samples = 3 * _UNIFORM_BATCH_SIZE
+    samples = np.stack([gaussian.sample(truncation) for _ in range(num_samples)])
+
+    lower, upper = np.full(2, -np.inf), np.full(2, np.inf)
+    for i, t in enumerate(truncation or [None, None]):
+        if t is not None:
+            lower[i] = -np.inf if t[0] is None else t[0]
+            upper[i] = np.inf if t[1] is None else t[1]
+
+    assert np.all(samples >= lower) and np.all(samples <= upper)
+    assert np.all(np.abs(samples - mean) <= 3 * stdev + 1e-12)
+
+    a = np.maximum((lower - mean) / stdev, -3.0)
+    b = np.minimum((upper - mean) / stdev, 3.0)
+    expected_mean = scipy.stats.truncnorm.mean(a, b, loc=mean, scale=stdev)
+    assert np.allclose(
+        samples.mean(0), expected_mean, atol=4 * stdev.max() / np.sqrt(num_samples)
+    )
+
+
+@pytest.mark.parametrize("seeded", [False, True])
+def test_truncated_gaussian_sample_partial_lower(seeded):
+    np.random.seed(0)
+    mean, stdev = np.array([0.1, 0.2]), np.array([0.1, 0.2])
+    gaussian = _TruncatedMultivariateGaussian(
+        mean, stdev ** 2, rng=np.random.default_rng(0) if seeded else None
+    )
+
+    # Alternate between truncations on every call and draw enough to go through
+    # several batches of uniforms
+    truncations = [(0, 0.05), (1, 0.0), (0, 0.15), (1, -1.0)]
+    num_samples = 3 * _UNIFORM_BATCH_SIZE
+    samples = {truncation: [] for truncation in truncations}
+    for _ in range(num_samples):
+        for lane, lower in truncations:
+            samples[(lane, lower)].append(gaussian.sample_partial_lower(lower, lane))
+
+    for (lane, lower), lane_samples in samples.items():
+        lane_samples = np.stack(lane_samples)
+        assert np.all(lane_samples[:, lane] >= lower)
+        assert np.all(np.abs(lane_samples - mean) <= 3 * stdev + 1e-12)
+
+        a = np.full(2, -3.0)
+        a[lane] = max((lower - mean[lane]) / stdev[lane], -3.0)
+        expected_mean = scipy.stats.truncnorm.mean(a, 3.0, loc=mean, scale=stdev)
+        assert np.allclose(
+            lane_samples.mean(0),
+            expected_mean,
+            atol=4 * stdev.max() / np.sqrt(num_samples),
+        )